@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import xlsxwriter
 import os
+import io
 from roster_engine import load_and_analyze_data, generate_roster
 
 # Page Configuration
@@ -75,16 +78,105 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # Helper Function to Load/Generate Data
-# Cache must be handled carefully with uploader. We'll use session state or simple caching on the generator.
+# Cache must be handled carefully with uploader. Loading is cached on the file itself, while the
+# expensive solve is cached on the DNA fingerprint so re-uploads of equivalent data skip CP-SAT.
+def _dna_fingerprint(dna):
+    # Only the fields generate_roster actually reads, in roster order
+    return tuple(
+        (emp_id, info['DNA'], info['Name'], info['Status'], info['Department'])
+        for emp_id, info in dna.items()
+    )
+
 @st.cache_data(show_spinner=True)
+def _cached_load(file_source):
+    return load_and_analyze_data(file_source)
+
+ROSTER_METADATA_COLS = ['Employee ID', 'Name', 'Dept', 'Status', 'Shift DNA', 'Total Shifts', 'Total_Work_Hours']
+
+@st.cache_data(show_spinner=True, hash_funcs={dict: _dna_fingerprint})
+def _cached_solve(dna, year=2026, month=3):
+    return generate_roster(dna, year, month)
+
 def cached_generate_roster(file_source):
-    df, dna = load_and_analyze_data(file_source)
+    df, dna = _cached_load(file_source)
     if df is None:
         return None, dna # dna contains error msg here
         
-    roster_df, err = generate_roster(dna)
+    roster_df, err = _cached_solve(dna)
     return roster_df, err
 
+def _build_absence_index(roster_df):
+    # Name -> row label (first match, like the old boolean-mask lookup) and a copy of the
+    # roster pre-sorted by fairness, so a replacement lookup needs no scan by name or sort
+    first_rows = roster_df.drop_duplicates(subset='Name')
+    name_to_idx = dict(zip(first_rows['Name'], first_rows.index))
+    sorted_by_fairness = roster_df.sort_values(by='Total Shifts', ascending=True, kind='stable')
+    return name_to_idx, sorted_by_fairness
+
+# Download payloads are cached so widget reruns don't re-serialise the whole roster
+@st.cache_data
+def _csv_bytes(roster_df):
+    return roster_df.to_csv(index=False).encode('utf-8')
+
+@st.cache_data
+def _xlsx_bytes(roster_df, date_cols):
+    buffer = io.BytesIO()
+    # constant_memory streams each row to disk as soon as the next one starts, so memory stays
+    # flat for large rosters. It only works when rows are written strictly in order, which
+    # pandas' to_excel does not do (it writes column by column), so rows are written directly.
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Sheet1')
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    shift_formats = {
+        'WO': workbook.add_format({'bg_color': '#FF4B4B', 'font_color': 'white', 'bold': True}),
+        'Day': workbook.add_format({'bg_color': '#FACC15', 'font_color': 'black', 'bold': True}),
+        'Night': workbook.add_format({'bg_color': '#94A3B8', 'font_color': 'white', 'bold': True}),
+    }
+    
+    # Colour the date block with native conditional formats
+    # (much faster than exporting a Styler, which resolves CSS for every cell)
+    first_col = roster_df.columns.get_loc(date_cols[0])
+    last_col = roster_df.columns.get_loc(date_cols[-1])
+    for shift, fmt in shift_formats.items():
+        worksheet.conditional_format(1, first_col, len(roster_df), last_col, {
+            'type': 'cell',
+            'criteria': '==',
+            'value': f'"{shift}"',
+            'format': fmt
+        })
+    
+    worksheet.write_row(0, 0, [str(c) for c in roster_df.columns], header_format)
+    # Missing values become None so they are written as blank cells, like to_excel does
+    values = roster_df.astype(object).where(roster_df.notna(), None)
+    for row_idx, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, row)
+    workbook.close()
+    return buffer.getvalue()
+
+@st.cache_data
+def _analytics_figures(roster_df):
+    # 1. Balance Chart
+    # Histogram of Total Shifts
+    fig = px.histogram(roster_df, x='Total Shifts', nbins=10, 
+                       title="Distribution of Workload (Total Shifts)",
+                       color_discrete_sequence=['#818cf8'])
+    fig.update_layout(paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)", font_color="white")
+    
+    # 2. Shift Type Breakdown
+    # Shift DNA is categorical, so skip DNA types that don't occur in this roster
+    dna_counts = roster_df['Shift DNA'].value_counts()[lambda s: s > 0].reset_index()
+    dna_counts.columns = ['Shift DNA', 'Count']
+    fig2 = px.pie(dna_counts, values='Count', names='Shift DNA', title="Shift DNA Distribution",
+                  color_discrete_sequence=px.colors.sequential.Bluyl)
+    fig2.update_layout(paper_bgcolor="rgba(0,0,0,0)", font_color="white")
+    
+    # Average Shifts by DNA
+    avg_shifts = roster_df.groupby('Shift DNA', observed=True)['Total Shifts'].mean().reset_index()
+    fig3 = px.bar(avg_shifts, x='Shift DNA', y='Total Shifts', title="Avg Shifts by DNA Type",
+                  color='Shift DNA', color_discrete_sequence=px.colors.sequential.Bluyl)
+    fig3.update_layout(paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)", font_color="white")
+    return fig, fig2, fig3
+
 # Header
 st.title("Inbound AI Roster Manager")
 st.markdown("### Smart Workforce Scheduling for March 2026")
@@ -97,16 +189,19 @@ uploaded_file = st.sidebar.file_uploader("Upload Roster Data (Excel/CSV)", type=
 # Data Logic
 roster_df = None
 error_msg = None
+roster_key = None
 
 try:
     if uploaded_file is not None:
         # Use uploaded file
         roster_df, error_msg = cached_generate_roster(uploaded_file)
+        roster_key = uploaded_file.file_id
     else:
         # Check for default file
         default_file = "Inbound Rooster.xlsx"
         if os.path.exists(default_file):
             roster_df, error_msg = cached_generate_roster(default_file)
+            roster_key = (default_file, os.path.getmtime(default_file))
         else:
             st.info("👋 Welcome! Please upload your 'Inbound Rooster' Excel/CSV file to get started.")
             
@@ -117,37 +212,33 @@ except Exception as e:
     st.error(f"An unexpected error occurred: {e}")
 
 
-# Main App Display
-if roster_df is not None:
-    # Sidebar - Absence Manager (Only show if data is loaded)
-    st.sidebar.markdown("---")
-    st.sidebar.title("Absence Manager")
-    st.sidebar.markdown("Find the best replacement for an absent employee.")
+@st.fragment
+def absence_manager(roster_df, date_cols, absence_index):
+    # Runs as a fragment: its widgets only rerun this function, so picking a date or
+    # employee doesn't rebuild the styled roster or the charts in the main area
     
     # 1. Select Date
-    # Get date columns from roster_df (exclude metadata)
-    metadata_cols = ['Employee ID', 'Name', 'Dept', 'Status', 'Shift DNA', 'Total Shifts', 'Total_Work_Hours']
-    date_cols = [c for c in roster_df.columns if c not in metadata_cols]
-    
-    selected_date = st.sidebar.selectbox("Select Date", date_cols)
+    selected_date = st.selectbox("Select Date", date_cols)
     
     # 2. Select Employee (who is absent)
     # Filter only employees who are working on that day (Day or Night)
     working_on_date = roster_df[roster_df[selected_date].isin(['Day', 'Night'])]
-    selected_emp_name = st.sidebar.selectbox("Absent Employee", working_on_date['Name'].unique())
+    selected_emp_name = st.selectbox("Absent Employee", working_on_date['Name'].unique())
     
     # Find Replacement Logic
-    if st.sidebar.button("Find Replacement"):
+    if st.button("Find Replacement"):
         # Get Absent Employee Details
-        absent_emp_row = roster_df[roster_df['Name'] == selected_emp_name].iloc[0]
+        name_to_idx, sorted_by_fairness = absence_index
+        absent_emp_row = roster_df.loc[name_to_idx[selected_emp_name]]
         absent_shift = absent_emp_row[selected_date]
         
-        st.sidebar.markdown("---")
-        st.sidebar.markdown(f"**Request:** Replace **{selected_emp_name}** ({absent_shift}) on **{selected_date}**")
+        st.markdown("---")
+        st.markdown(f"**Request:** Replace **{selected_emp_name}** ({absent_shift}) on **{selected_date}**")
         
         # Candidate Logic
         # 1. Must be on WO this day
-        candidates = roster_df[roster_df[selected_date] == 'WO'].copy()
+        # (sorted_by_fairness is already ordered by Total Shifts - Fairness, lowest first)
+        candidates = sorted_by_fairness[sorted_by_fairness[selected_date] == 'WO']
         
         # 2. DNA Match
         # If absent_shift is 'Night', Candidate cannot be 'Fixed_Day'
@@ -156,41 +247,58 @@ if roster_df is not None:
             candidates = candidates[candidates['Shift DNA'] != 'Fixed_Day']
         elif absent_shift == 'Day':
             candidates = candidates[candidates['Shift DNA'] != 'Fixed_Night']
-            
-        # 3. Sort by Total Shifts (Fairness - lowest first)
-        candidates = candidates.sort_values(by='Total Shifts', ascending=True)
         
         if not candidates.empty:
             best_fit = candidates.iloc[0]
-            st.sidebar.success(f"**Best Fit:** {best_fit['Name']}")
-            st.sidebar.info(f"Shift DNA: {best_fit['Shift DNA']}")
-            st.sidebar.info(f"Total Shifts: {best_fit['Total Shifts']}")
+            st.success(f"**Best Fit:** {best_fit['Name']}")
+            st.info(f"Shift DNA: {best_fit['Shift DNA']}")
+            st.info(f"Total Shifts: {best_fit['Total Shifts']}")
             
             # Show top 5
-            st.sidebar.markdown("#### Top Alternatives")
-            st.sidebar.dataframe(candidates[['Name', 'Shift DNA', 'Total Shifts']].head(5), hide_index=True)
+            st.markdown("#### Top Alternatives")
+            st.dataframe(candidates[['Name', 'Shift DNA', 'Total Shifts']].head(5), hide_index=True)
         else:
-            st.sidebar.error("No suitable replacement found!")
+            st.error("No suitable replacement found!")
+
+# Main App Display
+if roster_df is not None:
+    # Sidebar - Absence Manager (Only show if data is loaded)
+    st.sidebar.markdown("---")
+    st.sidebar.title("Absence Manager")
+    st.sidebar.markdown("Find the best replacement for an absent employee.")
+    
+    # Get date columns from roster_df (exclude metadata)
+    date_cols = [c for c in roster_df.columns if c not in ROSTER_METADATA_COLS]
+    
+    # Build the absence index once per roster and keep it in session state; the fragment
+    # gets it as an argument, so Find Replacement clicks never re-sort or hash the roster
+    if st.session_state.get('absence_index_key') != roster_key:
+        st.session_state['absence_index'] = _build_absence_index(roster_df)
+        st.session_state['absence_index_key'] = roster_key
+    
+    with st.sidebar:
+        absence_manager(roster_df, date_cols, st.session_state['absence_index'])
 
     # Main Dashboard
     
     # Tabs
     tab1, tab2 = st.tabs(["📋 Roster View", "📊 Analytics"])
     
-    # Define Styling Function (Shared for UI and Excel)
-    def color_roster(val):
-        # Colors: 
-        # WO -> Red (#ff4b4b)
-        # Day -> Yellow (#facc15)
-        # Night -> Steel (#94a3b8)
-        val_str = str(val).strip()
-        if val_str == 'WO':
-            return 'background-color: #ff4b4b; color: white; font-weight: bold;'
-        elif val_str == 'Day':
-            return 'background-color: #facc15; color: black; font-weight: bold;'
-        elif val_str == 'Night':
-            return 'background-color: #94a3b8; color: white; font-weight: bold;'
-        return ''
+    # Define Styling Function (column-wise, so the Styler calls it once per date column)
+    # Colors: 
+    # WO -> Red (#ff4b4b)
+    # Day -> Yellow (#facc15)
+    # Night -> Steel (#94a3b8)
+    SHIFT_STYLES = {
+        'WO': 'background-color: #ff4b4b; color: white; font-weight: bold;',
+        'Day': 'background-color: #facc15; color: black; font-weight: bold;',
+        'Night': 'background-color: #94a3b8; color: white; font-weight: bold;',
+    }
+
+    def color_roster_col(col):
+        vals = col.astype(str).str.strip()
+        styles = np.select([vals == shift for shift in SHIFT_STYLES], list(SHIFT_STYLES.values()), default='')
+        return pd.Series(styles, index=col.index)
 
     with tab1:
         # Search/Filter
@@ -212,7 +320,7 @@ if roster_df is not None:
             display_df = display_df[display_df['Shift DNA'].isin(shift_filter)]
             
         # Apply to date columns only
-        styled_df = display_df.style.map(color_roster, subset=date_cols)
+        styled_df = display_df.style.apply(color_roster_col, subset=date_cols, axis=0)
         
         st.dataframe(styled_df, use_container_width=True, height=600)
         
@@ -220,22 +328,16 @@ if roster_df is not None:
         with col_dl1:
             st.download_button(
                 "Download Roster CSV",
-                roster_df.to_csv(index=False).encode('utf-8'),
+                _csv_bytes(roster_df),
                 "March_2026_Roster.csv",
                 "text/csv",
                 key='download-csv'
             )
         
         with col_dl2:
-            import io
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                # Apply styling to the full roster_df before exporting
-                roster_df.style.map(color_roster, subset=date_cols).to_excel(writer, index=False, sheet_name='Sheet1')
-                
             st.download_button(
                 label="Download Roster Excel",
-                data=buffer.getvalue(),
+                data=_xlsx_bytes(roster_df, date_cols),
                 file_name="March_2026_Roster.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 key='download-excel'
@@ -244,28 +346,15 @@ if roster_df is not None:
     with tab2:
         st.markdown("### Workforce Balance & Fairness")
         
+        fig, fig2, fig3 = _analytics_figures(roster_df)
+        
         # 1. Balance Chart
-        # Histogram of Total Shifts
-        fig = px.histogram(roster_df, x='Total Shifts', nbins=10, 
-                           title="Distribution of Workload (Total Shifts)",
-                           color_discrete_sequence=['#818cf8'])
-        fig.update_layout(paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)", font_color="white")
         st.plotly_chart(fig, use_container_width=True)
         
         # 2. Shift Type Breakdown
         col1, col2 = st.columns(2)
         with col1:
-            dna_counts = roster_df['Shift DNA'].value_counts().reset_index()
-            dna_counts.columns = ['Shift DNA', 'Count']
-            fig2 = px.pie(dna_counts, values='Count', names='Shift DNA', title="Shift DNA Distribution",
-                          color_discrete_sequence=px.colors.sequential.Bluyl)
-            fig2.update_layout(paper_bgcolor="rgba(0,0,0,0)", font_color="white")
             st.plotly_chart(fig2, use_container_width=True)
             
         with col2:
-            # Average Shifts by DNA
-            avg_shifts = roster_df.groupby('Shift DNA')['Total Shifts'].mean().reset_index()
-            fig3 = px.bar(avg_shifts, x='Shift DNA', y='Total Shifts', title="Avg Shifts by DNA Type",
-                          color='Shift DNA', color_discrete_sequence=px.colors.sequential.Bluyl)
-            fig3.update_layout(paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)", font_color="white")
             st.plotly_chart(fig3, use_container_width=True)
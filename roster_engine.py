@@ -1,7 +1,49 @@
 import pandas as pd
+import numpy as np
 from ortools.sat.python import cp_model
 import datetime
 import calendar
+import os
+
+# Prefer the Rust-backed calamine reader for Excel when it is installed
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+# Metadata columns as per prompt
+METADATA_COLS = ['Employee ID', 'User ID', 'NAME', 'Status', 'Department']
+
+def _get_date_cols(columns):
+    # Identify date columns (columns that are not metadata and not 'Unnamed' or 'Remarks')
+    date_cols = []
+    for col in columns:
+        if col not in METADATA_COLS and not str(col).startswith("Unnamed") and col != "Remarks":
+            date_cols.append(col)
+    return date_cols
+
+def _read_excel_typed(file_source):
+    """
+    Reads an Excel roster with explicit dtypes so pandas can skip type inference.
+    The header row is read first to find the date columns, then the sheet is
+    re-read without the trailing 'Unnamed' junk columns.
+    """
+    header = pd.read_excel(file_source, nrows=0, engine=EXCEL_ENGINE)
+    if hasattr(file_source, 'seek'):
+        file_source.seek(0)
+    
+    # Employee ID is left to pandas so it keeps its numeric type in the generated roster
+    dtypes = {c: 'string' for c in _get_date_cols(header.columns)}
+    dtypes.update({'NAME': 'string', 'Status': 'category', 'Department': 'category'})
+    dtypes = {c: t for c, t in dtypes.items() if c in header.columns}
+    
+    return pd.read_excel(
+        file_source,
+        engine=EXCEL_ENGINE,
+        dtype=dtypes,
+        usecols=lambda c: not str(c).startswith("Unnamed")
+    )
 
 def load_and_analyze_data(file_source):
     """
@@ -14,7 +56,7 @@ def load_and_analyze_data(file_source):
             if file_source.endswith('.csv'):
                  df = pd.read_csv(file_source)
             else:
-                 df = pd.read_excel(file_source)
+                 df = _read_excel_typed(file_source)
         else:
             # File-like object (Streamlit uploader)
             # Try excel first, then csv
@@ -22,60 +64,61 @@ def load_and_analyze_data(file_source):
             if hasattr(file_source, 'name') and file_source.name.endswith('.csv'):
                 df = pd.read_csv(file_source)
             else:
-                df = pd.read_excel(file_source)
+                df = _read_excel_typed(file_source)
                 
     except Exception as e:
         return None, f"Error loading file: {e}"
 
-    # Metadata columns as per prompt
-    metadata_cols = ['Employee ID', 'User ID', 'NAME', 'Status', 'Department']
-    
-    # Identify date columns (columns that are not metadata and not 'Unnamed' or 'Remarks')
-    date_cols = []
-    for col in df.columns:
-        if col not in metadata_cols and not str(col).startswith("Unnamed") and col != "Remarks":
-            date_cols.append(col)
+    date_cols = _get_date_cols(df.columns)
             
-    employee_dna = {}
+    # Normalise the whole date block once and count shifts per employee in a
+    # single vectorized pass instead of looping over every cell in Python.
+    block = df[date_cols].astype(str).apply(lambda s: s.str.strip().str.upper()).to_numpy()
+    day_counts = (block == 'DAY').sum(axis=1)
+    night_counts = (block == 'NIGHT').sum(axis=1)
     
-    for _, row in df.iterrows():
-        emp_id = row['Employee ID']
-        name = row['NAME']
-        
-        day_count = 0
-        night_count = 0
-        
-        for col in date_cols:
-            val = str(row[col]).strip().upper()
-            if val == 'DAY':
-                day_count += 1
-            elif val == 'NIGHT':
-                night_count += 1
-        
-        # Determine DNA
-        if day_count > 0 and night_count == 0:
-            dna = 'Fixed_Day'
-        elif night_count > 0 and day_count == 0:
-            dna = 'Fixed_Night'
-        else:
-            # If mixed or no data (e.g. new joiner or all WO), default to Rotating
-            # Prompt: "If they have both... tag them as Rotating"
-            dna = 'Rotating' 
-            
-        employee_dna[emp_id] = {
+    # Determine DNA
+    # If mixed or no data (e.g. new joiner or all WO), default to Rotating
+    # Prompt: "If they have both... tag them as Rotating"
+    dnas = np.where((day_counts > 0) & (night_counts == 0), 'Fixed_Day',
+                    np.where((night_counts > 0) & (day_counts == 0), 'Fixed_Night', 'Rotating'))
+    
+    employee_dna = {
+        emp_id: {
             'Name': name,
-            'DNA': dna,
-            'Day_Count': day_count,
-            'Night_Count': night_count,
-            'Status': row['Status'],
-            'Department': row['Department']
+            'DNA': str(dna),
+            'Day_Count': int(day_count),
+            'Night_Count': int(night_count),
+            'Status': status,
+            'Department': dept
         }
+        for emp_id, name, dna, day_count, night_count, status, dept in zip(
+            df['Employee ID'].to_numpy(), df['NAME'].to_numpy(), dnas,
+            day_counts, night_counts, df['Status'].to_numpy(), df['Department'].to_numpy()
+        )
+    }
         
     return df, employee_dna
 
-def generate_roster(employee_dna, year=2026, month=3):
+class EarlyStop(cp_model.CpSolverSolutionCallback):
+    """
+    Stops the search as soon as a solution's workload spread (max_work - min_work)
+    is within the target, instead of spending the whole time budget proving optimality.
+    """
+    def __init__(self, target):
+        super().__init__()
+        self.target = target
+
+    def on_solution_callback(self):
+        if self.ObjectiveValue() <= self.target:
+            self.StopSearch()
+
+def generate_roster(employee_dna, year=2026, month=3, target_spread=1, min_shift_coverage=0.2):
     """
     Generates a roster for the given month using OR-Tools.
+    Every day, at least min_shift_coverage of the employees able to work Day (resp. Night)
+    are on that shift. The solver stops early once the spread of total shifts is at most
+    target_spread.
     """
     model = cp_model.CpModel()
     
@@ -90,27 +133,32 @@ def generate_roster(employee_dna, year=2026, month=3):
     # Shifts: 0: WO, 1: Day, 2: Night
     shifts = [0, 1, 2] # WO, Day, Night
     
-    # Variables: roster[(e, d)] = shift
-    roster = {}
+    # Variables: one Boolean per allowed shift for every (e, d); exactly one of them is true.
+    # These are reused directly in every constraint below, so no reification is needed.
+    # DNA Constraints are baked in here: a Fixed_Day employee simply has no Night (2)
+    # Boolean and a Fixed_Night employee no Day (1) Boolean, so missing keys count as 0.
+    allowed_shifts = {
+        'Fixed_Day': ('wo', 'day'),
+        'Fixed_Night': ('wo', 'night'),
+        'Rotating': ('wo', 'day', 'night')
+    }
+    wo = {}
+    day_b = {}
+    night_b = {}
     for e in emp_indices:
+        allowed = allowed_shifts[employee_dna[employees[e]]['DNA']]
         for d in days_indices:
-            roster[(e, d)] = model.NewIntVar(0, 2, f'shift_e{e}_d{d}')
+            wo[(e, d)] = model.NewBoolVar(f'wo_e{e}_d{d}')
+            if 'day' in allowed:
+                day_b[(e, d)] = model.NewBoolVar(f'day_e{e}_d{d}')
+            if 'night' in allowed:
+                night_b[(e, d)] = model.NewBoolVar(f'night_e{e}_d{d}')
+            model.AddExactlyOne(
+                [wo[(e, d)]] + [v[(e, d)] for v in (day_b, night_b) if (e, d) in v]
+            )
             
     # 2. Hard Constraints
     
-    # DNA Constraints
-    for e in emp_indices:
-        emp_id = employees[e]
-        dna = employee_dna[emp_id]['DNA']
-        
-        for d in days_indices:
-            if dna == 'Fixed_Day':
-                # Cannot be Night (2)
-                model.Add(roster[(e, d)] != 2)
-            elif dna == 'Fixed_Night':
-                # Cannot be Day (1)
-                model.Add(roster[(e, d)] != 1)
-                
     # Weekly Offs: Exactly 2 WOs per week (Sunday to Saturday)
     # Identify weeks in March 2026
     # March 1, 2026 is a Sunday. 
@@ -148,13 +196,17 @@ def generate_roster(employee_dna, year=2026, month=3):
     if current_week:
         weeks.append(current_week)
         
+    # The per-week constraint families (Weekly Offs, Shift Lock) are emitted in a single pass
+    # over (week, employee), which also collects each employee's worked-shift Booleans.
+    # Shift Lock: Within a Sunday-Saturday week, employee cannot mix Day (1) and Night (2).
+    # One Boolean per (employee, week) picks the week's shift: 0 = day-week, 1 = night-week.
+    # Only Rotating employees can mix at all, so only they need the lock.
+    night_week = {}
+    work_vars = {e: [] for e in emp_indices}
     for w_idx, week_days in enumerate(weeks):
         for e in emp_indices:
             # Count WOs (shift == 0)
-            is_wo = [model.NewBoolVar(f'is_wo_e{e}_d{d}') for d in week_days]
-            for i, d in enumerate(week_days):
-                model.Add(roster[(e, d)] == 0).OnlyEnforceIf(is_wo[i])
-                model.Add(roster[(e, d)] != 0).OnlyEnforceIf(is_wo[i].Not())
+            is_wo = [wo[(e, d)] for d in week_days]
             
             if len(week_days) == 7:
                 model.Add(sum(is_wo) == 2)
@@ -164,66 +216,36 @@ def generate_roster(employee_dna, year=2026, month=3):
                 # User said "Each employee must be assigned exactly 2 'WO' days per week."
                 # I will assume this applies to full weeks. For < 7 days, I'll allow 0-2.
                 model.Add(sum(is_wo) <= 2) 
-
-    # Shift Lock: Within a Sunday-Saturday week, employee cannot mix Day (1) and Night (2).
-    # sum(Day) > 0 => sum(Night) == 0
-    for week_days in weeks:
-        for e in emp_indices:
-            has_day = model.NewBoolVar(f'has_day_e{e}_w{week_days[0]}')
-            has_night = model.NewBoolVar(f'has_night_e{e}_w{week_days[0]}')
             
-            # Indicator variables for day/night presence in the week
-            day_vars = []
-            night_vars = []
-            for d in week_days:
-                is_day = model.NewBoolVar(f'is_day_e{e}_d{d}')
-                is_night = model.NewBoolVar(f'is_night_e{e}_d{d}')
-                
-                model.Add(roster[(e, d)] == 1).OnlyEnforceIf(is_day)
-                model.Add(roster[(e, d)] != 1).OnlyEnforceIf(is_day.Not())
-                
-                model.Add(roster[(e, d)] == 2).OnlyEnforceIf(is_night)
-                model.Add(roster[(e, d)] != 2).OnlyEnforceIf(is_night.Not())
-                
-                day_vars.append(is_day)
-                night_vars.append(is_night)
-                
-            # Link has_day / has_night to individual days
-            model.AddMaxEquality(has_day, day_vars)
-            model.AddMaxEquality(has_night, night_vars)
+            week_day = [day_b[(e, d)] for d in week_days if (e, d) in day_b]
+            week_night = [night_b[(e, d)] for d in week_days if (e, d) in night_b]
+            work_vars[e].extend(week_day)
+            work_vars[e].extend(week_night)
             
-            # Constraint: Cannot have both
-            # has_day + has_night <= 1
-            model.Add(has_day + has_night <= 1)
+            if week_day and week_night:
+                night_week[(e, w_idx)] = model.NewBoolVar(f'night_week_e{e}_w{week_days[0]}')
+                for v in week_night:
+                    model.Add(v <= night_week[(e, w_idx)])
+                for v in week_day:
+                    model.Add(v <= 1 - night_week[(e, w_idx)])
+
+    # Coverage: keep both shifts staffed every day. The minimum is a share of the employees
+    # whose DNA allows that shift, rounded down so small rosters stay feasible.
+    for d in days_indices:
+        for shift_b in (day_b, night_b):
+            on_shift = [shift_b[(e, d)] for e in emp_indices if (e, d) in shift_b]
+            if on_shift:
+                model.Add(sum(on_shift) >= int(min_shift_coverage * len(on_shift)))
 
     # 3. Soft Constraints (Objectives)
     # Equitable Distribution: Balanced total Day and Night shifts across employees.
     # We want to minimize the variance or difference from the mean.
     # Linearizing variance is hard. We can minimize the range (Max - Min).
     
-    total_days = [model.NewIntVar(0, num_days, f'total_days_e{e}') for e in emp_indices]
-    total_nights = [model.NewIntVar(0, num_days, f'total_nights_e{e}') for e in emp_indices]
-    
-    for e in emp_indices:
-        d_vars = []
-        n_vars = []
-        for d in days_indices:
-            is_d = model.NewBoolVar(f'obj_is_d_e{e}_d{d}')
-            is_n = model.NewBoolVar(f'obj_is_n_e{e}_d{d}')
-            model.Add(roster[(e, d)] == 1).OnlyEnforceIf(is_d)
-            model.Add(roster[(e, d)] != 1).OnlyEnforceIf(is_d.Not())
-            model.Add(roster[(e, d)] == 2).OnlyEnforceIf(is_n)
-            model.Add(roster[(e, d)] != 2).OnlyEnforceIf(is_n.Not())
-            d_vars.append(is_d)
-            n_vars.append(is_n)
-        
-        model.Add(total_days[e] == sum(d_vars))
-        model.Add(total_nights[e] == sum(n_vars))
-
-    # Minimize spread of total workings shifts (Day + Night)
+    # Minimize spread of total workings shifts (Day + Night), summed straight off the shift Booleans
     total_work = [model.NewIntVar(0, num_days, f'total_work_e{e}') for e in emp_indices]
     for e in emp_indices:
-        model.Add(total_work[e] == total_days[e] + total_nights[e])
+        model.Add(total_work[e] == sum(work_vars[e]))
         
     min_work = model.NewIntVar(0, num_days, 'min_work')
     max_work = model.NewIntVar(0, num_days, 'max_work')
@@ -234,36 +256,85 @@ def generate_roster(employee_dna, year=2026, month=3):
     # but Total Work balance is the primary "burnout" prevention.
     model.Minimize(max_work - min_work)
     
+    # Warm start: hint a simple valid roster so CP-SAT reaches a first feasible solution almost
+    # immediately. The hint is staggered by employee so every day keeps staff on shift: each
+    # employee's weekly WOs sit on consecutive days offset by e within the week, and Rotating
+    # staff alternate Day/Night weeks with their phase offset by e // len(week), so the phase
+    # is independent of the WO offset even in short partial weeks. Partial weeks get a
+    # pro-rated WO count that is the same for everyone, so the hint itself has zero spread.
+    # Every variable is hinted; CP-SAT spends a long time completing a partial hint.
+    hinted_work = []
+    for e in emp_indices:
+        dna = employee_dna[employees[e]]['DNA']
+        work_count = 0
+        for w_idx, week_days in enumerate(weeks):
+            night_phase = (w_idx + e // len(week_days)) % 2
+            work_shift = 'night' if dna == 'Fixed_Night' or (dna == 'Rotating' and night_phase) else 'day'
+            if (e, w_idx) in night_week:
+                model.AddHint(night_week[(e, w_idx)], work_shift == 'night')
+            num_wo = 2 if len(week_days) == 7 else round(2 * len(week_days) / 7)
+            wo_days = {week_days[(e + i) % len(week_days)] for i in range(num_wo)}
+            for d in week_days:
+                if d in wo_days:
+                    hint = 'wo'
+                else:
+                    hint = work_shift
+                    work_count += 1
+                model.AddHint(wo[(e, d)], hint == 'wo')
+                if (e, d) in day_b:
+                    model.AddHint(day_b[(e, d)], hint == 'day')
+                if (e, d) in night_b:
+                    model.AddHint(night_b[(e, d)], hint == 'night')
+        model.AddHint(total_work[e], work_count)
+        hinted_work.append(work_count)
+    if hinted_work:
+        model.AddHint(min_work, min(hinted_work))
+        model.AddHint(max_work, max(hinted_work))
+    
     # Solve
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = 30.0
-    status = solver.Solve(model)
+    # Run CP-SAT's parallel portfolio on every available core
+    solver.parameters.num_workers = os.cpu_count() or 8
+    solver.parameters.log_search_progress = False
+    # The symmetry pass costs ~2 s on large rosters with coverage constraints and is not needed
+    # to prove the hinted zero-spread roster optimal
+    solver.parameters.symmetry_level = 0
+    status = solver.Solve(model, EarlyStop(target_spread))
     
     if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
         # Build Result DataFrame
-        data = []
-        shift_map = {0: 'WO', 1: 'Day', 2: 'Night'}
-        
+        # Shift codes are collected as int8 (0: WO, 1: Day, 2: Night) and the date columns are
+        # categoricals over those codes, so filters compare small ints instead of Python strings
+        shift_labels = ['WO', 'Day', 'Night']
+        codes = np.zeros((len(employees), num_days), dtype=np.int8)
         for e in emp_indices:
-            row = {
-                'Employee ID': employees[e],
-                'Name': employee_dna[employees[e]]['Name'],
-                'Dept': employee_dna[employees[e]]['Department'],
-                'Status': employee_dna[employees[e]]['Status'],
-                'Shift DNA': employee_dna[employees[e]]['DNA']
-            }
             for d in days_indices:
-                s_val = solver.Value(roster[(e, d)])
-                row[str(dates[d])] = shift_map[s_val]
-            
-            # Add counts
-            t_d = solver.Value(total_days[e])
-            t_n = solver.Value(total_nights[e])
-            row['Total_Work_Hours'] = (t_d + t_n) * 9 # Assuming 9h shift, or just count. Using Count for now.
-            row['Total Shifts'] = t_d + t_n
-            data.append(row)
-            
-        result_df = pd.DataFrame(data)
+                if (e, d) in day_b and solver.BooleanValue(day_b[(e, d)]):
+                    codes[e, d] = 1
+                elif (e, d) in night_b and solver.BooleanValue(night_b[(e, d)]):
+                    codes[e, d] = 2
+        
+        # Repeatedly filtered/grouped in the app, so store the low-cardinality labels as categoricals
+        columns = {
+            'Employee ID': employees,
+            'Name': [employee_dna[emp_id]['Name'] for emp_id in employees],
+            'Dept': [employee_dna[emp_id]['Department'] for emp_id in employees],
+            'Status': pd.Categorical([employee_dna[emp_id]['Status'] for emp_id in employees]),
+            'Shift DNA': pd.Categorical(
+                [employee_dna[emp_id]['DNA'] for emp_id in employees],
+                categories=['Fixed_Day', 'Fixed_Night', 'Rotating']
+            )
+        }
+        for d in days_indices:
+            columns[str(dates[d])] = pd.Categorical.from_codes(codes[:, d], categories=shift_labels)
+        
+        # Add counts
+        total_shifts = (codes != 0).sum(axis=1)
+        columns['Total_Work_Hours'] = total_shifts * 9 # Assuming 9h shift, or just count. Using Count for now.
+        columns['Total Shifts'] = total_shifts
+        
+        result_df = pd.DataFrame(columns)
         return result_df, None
     else:
         return None, "No feasible roster found. Constraints might be too strict."